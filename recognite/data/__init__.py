@@ -1,4 +1,7 @@
-from .train_val_datasets import train_val_datasets  # noqa
+from .train_val_datasets import train_val_datasets,\
+    train_val_datasets_from_df  # noqa
 from .data_frame_dataset import DataFrameDataset  # noqa
 from .gallery_query_split import split_gallery_query  # noqa
 from .k_fold import k_fold_trainval_split  # noqa
+from .preload import preload  # noqa
+from .dataloaders import train_val_dataloaders  # noqa
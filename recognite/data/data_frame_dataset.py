@@ -9,7 +9,9 @@ class DataFrameDataset(Dataset):
     """A dataset based on a pandas DataFrame.
 
     The provided DataFrame contains the path of each image and the
-    corresponding label.
+    corresponding label. The image paths and (integer) labels are snapshotted
+    at construction, so later changes to the DataFrame are not reflected in
+    the dataset.
 
     Args:
         df: The DataFrame containing the image paths and labels.
@@ -17,16 +19,19 @@ class DataFrameDataset(Dataset):
             image.
         image_key: The column in the DataFrame that contains the image path of
             each image.
-        label_to_int: A dictionary that maps the label to a unique integer.
+        label_to_int: A dictionary that maps the label to a unique integer. If
+            ``None``, the labels should already be integers and are returned
+            as they are.
         transform: A transform to apply to the image before returning it.
 
     Attributes:
-        df: The DataFrame with the image paths and labels.
+        df: The DataFrame with the image paths and labels (read-only).
         label_key: The column in the DataFrame that contains the label of each
             image.
         image_key: The column in the DataFrame that contains the image path of
             each image.
-        label_to_int: The dictionary that maps the label to a unique integer.
+        label_to_int: The dictionary that maps the label to a unique integer,
+            or ``None`` if the labels are integers themselves.
         transform: The transform applied to each image before returning it.
         unique_labels: The unique labels present in this dataset.
     """
@@ -35,23 +40,44 @@ class DataFrameDataset(Dataset):
         df: pd.DataFrame,
         label_key: str,
         image_key: str,
-        label_to_int: Dict[str, int],
+        label_to_int: Optional[Dict[str, int]],
         transform: Optional[Callable] = None,
     ):
-        self.df = df
+        self._df = df
         self.transform = transform
         self.label_key = label_key
         self.image_key = image_key
         self.label_to_int = label_to_int
-        self.unique_labels = set(self.label_to_int.keys())
+
+        # Look up the image paths and integer labels once, so that
+        # __getitem__ doesn't need to build a row Series for every sample.
+        if self.label_to_int is None:
+            if not pd.api.types.is_integer_dtype(df[label_key]):
+                raise TypeError(
+                    'label_to_int can only be None for integer labels, got '
+                    f'labels of type {df[label_key].dtype}.'
+                )
+            self.unique_labels = set(df[label_key].unique().tolist())
+            label_ints = df[label_key]
+        else:
+            self.unique_labels = set(self.label_to_int.keys())
+            label_ints = df[label_key].map(label_to_int)
+            if label_ints.isna().any():
+                missing = set(df.loc[label_ints.isna(), label_key])
+                raise KeyError(f'Labels missing from label_to_int: {missing}')
+        self._label_ints = label_ints.to_numpy(dtype=int)
+        self._image_paths = df[image_key].to_numpy()
+
+    @property
+    def df(self) -> pd.DataFrame:
+        return self._df
 
     def __len__(self):
-        return len(self.df)
+        return len(self._image_paths)
 
     def __getitem__(self, idx):
-        row = self.df.iloc[idx]
-        im = Image.open(row[self.image_key])
-        label = self.label_to_int[row[self.label_key]]
+        im = Image.open(self._image_paths[idx])
+        label = int(self._label_ints[idx])
 
         if self.transform is not None:
             im = self.transform(im)
@@ -0,0 +1,63 @@
+import os
+from typing import Optional, Tuple
+import warnings
+
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+
+def train_val_dataloaders(
+    ds_train: Dataset,
+    ds_gal: Dataset,
+    ds_quer: Dataset,
+    batch_size: int,
+    num_workers: Optional[int] = None,
+    shuffle_train: bool = True,
+) -> Tuple[DataLoader, DataLoader, DataLoader]:
+    """Creates data loaders for the training, gallery and query datasets.
+
+    Loading and transforming images is often the bottleneck of a training
+    pipeline. The data loaders therefore use multiple worker processes that
+    are kept alive between epochs (``persistent_workers=True``), and each
+    worker prefetches two batches. When CUDA is available, the batches are
+    put in pinned memory, so that they can be copied asynchronously to the
+    GPU (see :func:`recognite.eval.score_matrix`).
+
+    Args:
+        ds_train: The training dataset.
+        ds_gal: The gallery dataset.
+        ds_quer: The query dataset.
+        batch_size: The batch size of each data loader.
+        num_workers: The number of worker processes of each data loader. If
+            ``None``, use the number of CPUs, with a maximum of 8.
+        shuffle_train: If ``True``, shuffle the training data every epoch.
+            The gallery and query data are never shuffled.
+
+    Returns:
+        The training, gallery and query data loader.
+    """
+    if num_workers is None:
+        num_workers = min(8, os.cpu_count() or 1)
+
+    pin_memory = torch.cuda.is_available()
+
+    if num_workers == 0 and pin_memory:
+        warnings.warn(
+            'Using num_workers=0 while CUDA is available. Data loading will '
+            'happen in the main process and cannot overlap with the '
+            'computations on the GPU.'
+        )
+
+    kwargs = dict(
+        batch_size=batch_size,
+        num_workers=num_workers,
+        pin_memory=pin_memory,
+        persistent_workers=num_workers > 0,
+        prefetch_factor=2 if num_workers > 0 else None,
+    )
+
+    dl_train = DataLoader(ds_train, shuffle=shuffle_train, **kwargs)
+    dl_gal = DataLoader(ds_gal, shuffle=False, **kwargs)
+    dl_quer = DataLoader(ds_quer, shuffle=False, **kwargs)
+
+    return dl_train, dl_gal, dl_quer
@@ -27,20 +27,13 @@ def split_gallery_query(
     Returns:
         A tuple with the gallery and query DataFrame.
     """
-    df_copy = df.copy()
+    shuffled_df = df.sample(frac=1.0, random_state=seed)
+    groups = shuffled_df.groupby(label_key)
 
-    gal_idxs = []
-    undersampled_labels = []
+    gal_idxs = groups.head(num_refs).index
 
-    shuffled_df = df_copy.sample(frac=1.0, random_state=seed)
-
-    for label, group in shuffled_df.groupby(label_key):
-        true_num_refs = min(len(group), num_refs)
-
-        if true_num_refs < num_refs:
-            undersampled_labels.append(label)
-
-        gal_idxs.extend(group.iloc[:true_num_refs].index)
+    group_sizes = groups.size()
+    undersampled_labels = group_sizes.index[group_sizes < num_refs].tolist()
 
     if len(undersampled_labels) > 0:
         warnings.warn(
@@ -50,7 +43,7 @@ def split_gallery_query(
         )
         logging.debug(
             f'Labels without less than {num_refs} (num_refs) samples: '
-            ', '.join(undersampled_labels)
+            ', '.join(map(str, undersampled_labels))
         )
 
     gal_mask = df.index.isin(gal_idxs)
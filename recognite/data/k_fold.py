@@ -1,3 +1,4 @@
+from functools import lru_cache
 from typing import Tuple
 
 import numpy as np
@@ -35,15 +36,27 @@ def k_fold_trainval_split(
     """
     assert val_fold < num_folds
 
-    labels = df[label_key].unique()
-    np.random.seed(seed)
-    np.random.shuffle(labels)
-    label_folds = np.array_split(labels, num_folds)
+    labels = np.asarray(df[label_key].unique())
+    fold_idxs = _fold_idxs(len(labels), num_folds, seed)
+    val_labels = labels[fold_idxs[val_fold]]
 
-    val_labels = label_folds.pop(val_fold)
-    train_labels = np.concatenate(label_folds)
-
-    df_val = df[df[label_key].isin(val_labels)].reset_index(drop=True).copy()
-    df_train = df[df[label_key].isin(train_labels)].reset_index(drop=True)
+    val_mask = df[label_key].isin(val_labels)
+    df_val = df[val_mask].reset_index(drop=True).copy()
+    df_train = df[~val_mask].reset_index(drop=True)
 
     return df_train, df_val
+
+
+@lru_cache(maxsize=4)
+def _fold_idxs(
+    num_labels: int,
+    num_folds: int,
+    seed: int
+) -> Tuple[np.ndarray, ...]:
+    """Shuffles the label indices and splits them into folds.
+
+    The result only depends on the number of labels, so it is cached and
+    shared by all folds of a K-fold cross validation.
+    """
+    idxs = np.random.RandomState(seed).permutation(num_labels)
+    return tuple(np.array_split(idxs, num_folds))
@@ -0,0 +1,93 @@
+from itertools import chain
+from typing import Iterable, List, Optional, Tuple, Union
+import warnings
+
+import torch
+
+
+def preload(
+    dl: Iterable[Tuple[torch.Tensor, torch.Tensor]],
+    device: Union[str, torch.device],
+    max_bytes: Optional[int] = None,
+) -> Union[List[Tuple[torch.Tensor, torch.Tensor]], Iterable]:
+    """Loads all batches of a data loader onto a device.
+
+    Validation sets are often small enough for all their (transformed) images
+    to fit in device memory. Preloading the gallery and query loaders once and
+    passing the returned lists to :func:`recognite.eval.score_matrix` instead
+    of the loaders avoids reading, transforming and copying the images to the
+    device again in every validation epoch. Note that this only makes sense
+    when the validation transforms are deterministic.
+
+    Args:
+        dl: The data loader to preload. It should yield a tuple
+            ``(imgs, labels)`` containing the batch of images and labels when
+            iterating over it.
+        device: The device to load the batches onto.
+        max_bytes: The maximum number of bytes the preloaded images may occupy
+            on the device. We estimate the total size from the first batch
+            and the length of the data loader (or its dataset), so that we can
+            give up before loading everything. If the images (are estimated
+            to) exceed this, we issue a warning and return ``dl`` itself. If
+            ``dl`` can only be iterated once (e.g. a generator), we instead
+            return an iterator over the batches that were already read,
+            followed by the remaining ones. If ``None``, there is no limit.
+
+    Returns:
+        A list with the ``(imgs, labels)`` tuples on ``device``, or ``dl`` (or
+        an iterator over its batches) if the images did not fit in
+        ``max_bytes``.
+    """
+    loader_iter = iter(dl)
+    # A one-shot iterator cannot be iterated again, so we keep the batches we
+    # read from it, to hand them back if we give up
+    read_batches = [] if loader_iter is dl else None
+    batches = []
+    num_bytes = 0
+
+    for imgs, labels in loader_iter:
+        if read_batches is not None:
+            read_batches.append((imgs, labels))
+
+        if max_bytes is not None and len(batches) == 0:
+            est_num_bytes = _estimate_num_bytes(dl, imgs)
+            if est_num_bytes is not None and est_num_bytes > max_bytes:
+                return _give_up(dl, read_batches, loader_iter, max_bytes)
+
+        num_bytes += imgs.element_size() * imgs.nelement()
+        if max_bytes is not None and num_bytes > max_bytes:
+            return _give_up(dl, read_batches, loader_iter, max_bytes)
+
+        batches.append((
+            imgs.to(device, non_blocking=True),
+            labels.to(device, non_blocking=True),
+        ))
+
+    return batches
+
+
+def _estimate_num_bytes(dl, imgs):
+    """Estimates the size of all images in ``dl`` from its first batch."""
+    sample_bytes = imgs.element_size() * imgs[0].nelement()
+
+    try:
+        return sample_bytes * len(dl.dataset)
+    except (AttributeError, TypeError):
+        pass
+
+    try:
+        return sample_bytes * len(imgs) * len(dl)
+    except TypeError:
+        return None
+
+
+def _give_up(dl, read_batches, loader_iter, max_bytes):
+    warnings.warn(
+        f'The images do not fit in {max_bytes} bytes. Returning the '
+        'data loader without preloading.'
+    )
+
+    if read_batches is None:
+        return dl
+
+    return chain(read_batches, loader_iter)
@@ -1,4 +1,5 @@
-from typing import Callable, Optional, Tuple
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple, Union
 
 import pandas as pd
 
@@ -8,7 +9,7 @@ from .data_frame_dataset import DataFrameDataset
 
 
 def train_val_datasets(
-    data_csv_file: str,
+    data_csv_file: Union[str, Path],
     image_key: str = 'image',
     label_key: str = 'label',
     num_folds: int = 5,
@@ -18,6 +19,7 @@ def train_val_datasets(
     ref_seed: int = 0,
     tfm_train: Optional[Callable] = None,
     tfm_val: Optional[Callable] = None,
+    cache_parquet: bool = False,
 ) -> Tuple[DataFrameDataset, DataFrameDataset, DataFrameDataset]:
     """Creates training and validation datasets for recognition training.
 
@@ -49,6 +51,18 @@ def train_val_datasets(
     references per label) and ``ref_seed`` (the seed for the random
     generator that shuffles the data before splitting).
 
+    The training labels are mapped to the integers ``0`` to ``C - 1``, with
+    ``C`` the number of training labels. If the labels in the CSV file are
+    integers already, the validation datasets return them unchanged (their
+    ``label_to_int`` is ``None``). Otherwise, they are mapped to integers as
+    well.
+
+    When wrapping the returned datasets in a ``DataLoader``, consider setting
+    ``pin_memory=True`` (so that batches can be copied asynchronously to the
+    GPU) and ``persistent_workers=True`` (so that the worker processes are not
+    recreated every epoch). :func:`recognite.data.train_val_dataloaders`
+    creates data loaders with these settings.
+
     Args:
         data_csv_file: The path of the CSV file containing the images and
             corresponding labels.
@@ -67,12 +81,66 @@ def train_val_datasets(
             choosing gallery reference images.
         tfm_train: The transform to apply to the training images.
         tfm_val: The transform to apply to the validation images.
+        cache_parquet: If ``True``, store the parsed CSV file in a Parquet file
+            next to it, with ``.parquet`` appended to its name (e.g.
+            ``data.csv.parquet``), so that it does not overwrite an existing
+            ``data.parquet``. Later calls read this file instead of parsing
+            the CSV again, as long as it is newer than the CSV file. This
+            requires ``pyarrow`` or ``fastparquet``.
 
     Returns:
         The training dataset, the gallery dataset and the query dataset.
     """
-    df = pd.read_csv(data_csv_file)
+    if cache_parquet:
+        df = _read_csv_cached(data_csv_file)
+    else:
+        df = pd.read_csv(data_csv_file)
+
+    return train_val_datasets_from_df(
+        df, image_key=image_key, label_key=label_key,
+        num_folds=num_folds, val_fold=val_fold, fold_seed=fold_seed,
+        num_refs=num_refs, ref_seed=ref_seed,
+        tfm_train=tfm_train, tfm_val=tfm_val,
+    )
+
+
+def train_val_datasets_from_df(
+    df: pd.DataFrame,
+    image_key: str = 'image',
+    label_key: str = 'label',
+    num_folds: int = 5,
+    val_fold: int = 0,
+    fold_seed: int = 0,
+    num_refs: int = 1,
+    ref_seed: int = 0,
+    tfm_train: Optional[Callable] = None,
+    tfm_val: Optional[Callable] = None,
+) -> Tuple[DataFrameDataset, DataFrameDataset, DataFrameDataset]:
+    """Creates training and validation datasets from a DataFrame.
+
+    This does the same as :func:`train_val_datasets`, but starts from a
+    DataFrame instead of a CSV file. This is useful for K-fold cross
+    validation, where the data file can be read once and shared by all folds.
 
+    Args:
+        df: The DataFrame containing the images and corresponding labels.
+        image_key: The column in the DataFrame that contains the image path of
+            each image.
+        label_key: The column in the DataFrame that contains the label of each
+            image.
+        num_folds: The number of folds to use for splitting the dataset into
+            training and validation.
+        val_fold: The index of the fold to use for validation.
+        fold_seed: The random seed to use for k-fold splitting.
+        num_refs: The number of references per class in the gallery.
+        ref_seed: The state of the random generator used for randomly
+            choosing gallery reference images.
+        tfm_train: The transform to apply to the training images.
+        tfm_val: The transform to apply to the validation images.
+
+    Returns:
+        The training dataset, the gallery dataset and the query dataset.
+    """
     df_train, df_val = k_fold_trainval_split(
         df=df, num_folds=num_folds, val_fold=val_fold,
         seed=fold_seed,
@@ -86,18 +154,16 @@ def train_val_datasets(
     # Create training dataset
     ds_train = DataFrameDataset(
         df=df_train, label_key=label_key, image_key=image_key,
-        label_to_int={
-            label: label_idx
-            for label_idx, label in enumerate(df_train[label_key].unique())
-        },
+        label_to_int=_label_to_int(df_train[label_key]),
         transform=tfm_train
     )
 
-    # Create validation datasets
-    label_to_int_val = {
-        label: label_idx
-        for label_idx, label in enumerate(df_val[label_key].unique())
-    }
+    # Create validation datasets. Integer labels can be used as they are,
+    # because only the training labels need to be in range(num_classes).
+    if pd.api.types.is_integer_dtype(df_val[label_key]):
+        label_to_int_val = None
+    else:
+        label_to_int_val = _label_to_int(df_val[label_key])
     ds_gal = DataFrameDataset(
         df=df_gal, label_key=label_key, image_key=image_key,
         label_to_int=label_to_int_val,
@@ -110,3 +176,25 @@ def train_val_datasets(
     )
 
     return ds_train, ds_gal, ds_quer
+
+
+def _label_to_int(labels: pd.Series) -> Dict:
+    """Maps each unique label to an integer, in order of appearance."""
+    _, uniques = pd.factorize(labels, sort=False)
+    return dict(zip(uniques.tolist(), range(len(uniques))))
+
+
+def _read_csv_cached(data_csv_file: Union[str, Path]) -> pd.DataFrame:
+    """Reads a CSV file, using a Parquet copy of it when up to date."""
+    data_csv_file = Path(data_csv_file)
+    cache_file = data_csv_file.with_name(data_csv_file.name + '.parquet')
+
+    if (
+        cache_file.exists()
+        and cache_file.stat().st_mtime >= data_csv_file.stat().st_mtime
+    ):
+        return pd.read_parquet(cache_file)
+
+    df = pd.read_csv(data_csv_file)
+    df.to_parquet(cache_file, index=False)
+    return df
@@ -1,5 +1,6 @@
-from .accuracy import accuracy, top_k_accuracy  # noqa
+from .accuracy import accuracy, top_k_accuracy, top_all_accuracy  # noqa
 from .hard_pos_neg_scores import hard_pos_neg_scores  # noqa
 from .pr_metrics import pr_metrics  # noqa
-from .score_matrix import score_matrix, sort_scores  # noqa
+from .score_matrix import score_matrix, score_matrix_top_k,\
+    sort_scores  # noqa
 from .knn import knn, top_k  # noqa
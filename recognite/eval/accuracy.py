@@ -2,6 +2,7 @@ import torch
 from torch import Tensor
 
 from .knn import top_k
+from .score_matrix import _check_score_shapes
 
 
 def accuracy(
@@ -48,28 +49,33 @@ def top_k_accuracy(
     Returns:
         The top-k accuracy.
     """
+    if k == 1:
+        _check_score_shapes(scores, gallery_labels)
+        top_1_labels = gallery_labels[scores.argmax(dim=1)]
+        corr = top_1_labels == query_labels
+        return corr.float().mean()
+
     _, top_k_labels = top_k(scores, gallery_labels, k)
-    return _top_all_accuracy(query_labels, top_k_labels)
+    return top_all_accuracy(query_labels, top_k_labels)
 
 
-def _top_all_accuracy(
+def top_all_accuracy(
     query_labels: Tensor,
     top_all_labels: Tensor
-):
+) -> Tensor:
     """Computes the top-all accuracy.
 
     This is computed as the percentage of queries where any of the given labels
-    per query has the same label as the query.
+    per query has the same label as the query. Passing in the top k labels
+    returned by :func:`recognite.eval.score_matrix_top_k` gives the top-k
+    accuracy.
 
     Args:
-        scores: The scores for each query (rows) and each gallery item
-            (columns).
-        query_labels: The true label of each query (rows of ``scores``).
-        gallery_labels: The labels of the items in the gallery (columns of
-            ``scores``).
+        query_labels: The true label of each query.
+        top_all_labels: The labels to compare with each query (rows).
 
     Returns:
         The top-all accuracy.
     """
     corr = torch.any(top_all_labels == query_labels[:, None], dim=1)
-    return torch.sum(corr) / len(query_labels)
+    return corr.float().mean()
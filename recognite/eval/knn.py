@@ -2,7 +2,7 @@ from typing import Tuple
 
 import torch
 
-from .score_matrix import sort_scores
+from .score_matrix import _check_score_shapes
 
 
 def knn(
@@ -46,7 +46,7 @@ def top_k(
     Returns:
         A tuple with the scores and labels of the k highest similarities.
     """
-    s_scores, s_labels = sort_scores(
-        scores, gallery_labels
-    )
-    return s_scores[:, :k], s_labels[:, :k]
+    _check_score_shapes(scores, gallery_labels)
+    k = min(k, scores.shape[1])
+    top_k_scores, top_k_idxs = torch.topk(scores, k, dim=1)
+    return top_k_scores, gallery_labels[top_k_idxs]
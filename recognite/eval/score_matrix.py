@@ -1,4 +1,6 @@
+from functools import partial
 from typing import Callable, Optional, Tuple
+import warnings
 
 import torch
 from torch.utils.data import DataLoader
@@ -6,7 +8,7 @@ from torch import nn
 from tqdm import tqdm
 
 
-@torch.no_grad()
+@torch.inference_mode()
 def score_matrix(
     model: nn.Module,
     dl_gal: DataLoader,
@@ -14,7 +16,10 @@ def score_matrix(
     metric='inner',
     device: Optional[torch.device] = None,
     agg_gal_fn: Optional[Callable] = None,
-    get_embeddings_fn: Optional[Callable] = None
+    get_embeddings_fn: Optional[Callable] = None,
+    score_dtype: Optional[torch.dtype] = None,
+    use_compile: bool = False,
+    score_device: Optional[torch.device] = None,
 ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
     """Computes the score matrix for a given model, queries and gallery.
 
@@ -23,8 +28,11 @@ def score_matrix(
 
     We first iterate over the gallery batches to compute the gallery
     embeddings and compose a gallery. Then we compute the embedding of each
-    query image. Finally, we compute the score matrix as the dot product
-    between each pair of gallery and query embeddings.
+    query image. Finally, we compute the score matrix between each pair of
+    gallery and query embeddings. To keep the number of kernel launches low,
+    the scores of all queries are computed at once, or in large chunks of
+    queries if there are many. On CUDA, these chunks are scored in a separate
+    stream, overlapping with the embedding extraction of the next queries.
 
     The model should return a batch of embeddings when calling it with a batch
     of (transformed) images. You can also pass in a custom function
@@ -40,10 +48,12 @@ def score_matrix(
         model: The model used for embedding extraction.
         dl_gal: The data loader for the gallery data. It should yield a tuple
             ``(imgs, labels)`` containing the batch of images and labels when
-            iterating over it.
+            iterating over it. On CUDA, create it with ``pin_memory=True`` so
+            that the next batch can be copied to the device while the current
+            batch is being processed.
         dl_quer: The data loader for the query data. It should yield a tuple
             ``(imgs, labels)`` containing the batch of images and labels when
-            iterating over it.
+            iterating over it. On CUDA, create it with ``pin_memory=True``.
         metric: The metric to use for computing the scores. Can be ``'inner'`
             (inner prosuct), ``'cosine'`` (cosine similarity), ``'euclid'``
             (Euclidean distance), ``'sq_euclid'`` (squared Euclidean distance).
@@ -56,91 +66,616 @@ def score_matrix(
             the gallery labels.
         get_embeddings_fn: A custom function to use for embedding extraction.
             It should take two arguments: the model and the image batch.
+        score_dtype: The data type to cast the embeddings to before computing
+            the scores, e.g. ``torch.float16`` or ``torch.bfloat16``. Lower
+            precision halves the memory traffic of the score computation and
+            enables Tensor Cores on recent GPUs. The gallery embeddings are
+            cast after aggregation. If ``None``, the embeddings keep the data
+            type returned by the model.
+        use_compile: If ``True``, compile the embedding extraction and the
+            score computation with ``torch.compile``, specialized for static
+            shapes. This pays off when the same model is evaluated on many
+            batches, as compilation itself takes time and a smaller last
+            batch triggers a recompilation.
+        score_device: The device on which to compute the scores, e.g.
+            ``'cpu'`` for a gallery that is too large for the GPU. The
+            embeddings are still computed on ``device``. The gallery
+            embeddings are moved to ``score_device`` once, the query
+            embeddings are copied in chunks through a reused (pinned) buffer.
+            The returned tensors are on ``score_device``. If ``None``, use
+            ``device``.
 
     Returns:
         The score matrix, the labels of the gallery items (columns) and the
-        labels of the queries (rows).
+        labels of the queries (rows). As they are computed in inference mode,
+        these are inference tensors. Clone them if you need to modify them
+        in-place outside of inference mode.
     """
+    (scores,), gal_labels, quer_labels = _score_queries(
+        model, dl_gal, dl_quer, metric, device, agg_gal_fn,
+        get_embeddings_fn, score_dtype, use_compile, score_device,
+    )
+    return scores, gal_labels, quer_labels
+
+
+@torch.inference_mode()
+def score_matrix_top_k(
+    model: nn.Module,
+    dl_gal: DataLoader,
+    dl_quer: DataLoader,
+    k: int,
+    metric='inner',
+    device: Optional[torch.device] = None,
+    agg_gal_fn: Optional[Callable] = None,
+    get_embeddings_fn: Optional[Callable] = None,
+    score_dtype: Optional[torch.dtype] = None,
+    use_compile: bool = False,
+    score_device: Optional[torch.device] = None,
+    specialize: bool = False,
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """Computes the top k scores of each query for a given model and gallery.
+
+    This gives the same result as :func:`score_matrix` followed by
+    :func:`recognite.eval.top_k`, but without materializing the full score
+    matrix. Each chunk of queries is reduced to its top k scores right after
+    it has been scored. This way, the memory needed for the scores is
+    proportional to ``k`` instead of to the size of the gallery.
+
+    The top k labels can directly be used to compute the top-k accuracy with
+    :func:`recognite.eval.top_all_accuracy`.
+
+    Args:
+        model: The model used for embedding extraction.
+        dl_gal: The data loader for the gallery data. See
+            :func:`score_matrix`.
+        dl_quer: The data loader for the query data. See
+            :func:`score_matrix`.
+        k: The number of highest scores to keep for each query.
+        metric: The metric to use for computing the scores. See
+            :func:`score_matrix`.
+        device: The device on which to compute the embeddings. If ``None``,
+            use CUDA if it is available.
+        agg_gal_fn: A function that aggregates the gallery embeddings and
+            labels. See :func:`score_matrix`.
+        get_embeddings_fn: A custom function to use for embedding extraction.
+            See :func:`score_matrix`.
+        score_dtype: The data type to cast the embeddings to before computing
+            the scores. See :func:`score_matrix`.
+        use_compile: If ``True``, compile the embedding extraction and the
+            score computation. See :func:`score_matrix`.
+        score_device: The device on which to compute the scores. See
+            :func:`score_matrix`.
+        specialize: If ``True``, compile a single function that maps a batch
+            of query images to its top k scores and labels, specialized for
+            the gallery with ``torch.compile(mode='reduce-overhead',
+            dynamic=False)``. On CUDA, this captures the whole step in a CUDA
+            graph, removing most of the Python overhead per query batch. The
+            queries are then scored per batch and batches that are smaller
+            than the first one (e.g. the last one) are padded to its size.
+            This requires ``score_device`` to be the same as ``device``.
+
+    Returns:
+        The top k scores of each query (rows, in descending order), the
+        labels of the corresponding gallery items and the labels of the
+        queries.
+    """
+    (top_k_scores, top_k_labels), _, quer_labels = _score_queries(
+        model, dl_gal, dl_quer, metric, device, agg_gal_fn,
+        get_embeddings_fn, score_dtype, use_compile, score_device, k=k,
+        specialize=specialize,
+    )
+    return top_k_scores, top_k_labels, quer_labels
+
+
+def _score_queries(
+    model,
+    dl_gal,
+    dl_quer,
+    metric,
+    device,
+    agg_gal_fn,
+    get_embeddings_fn,
+    score_dtype,
+    use_compile,
+    score_device,
+    k=None,
+    specialize=False,
+):
+    """Scores the queries against the gallery.
+
+    If ``k`` is ``None``, returns a tuple with the scores of each query,
+    otherwise a tuple with the top k scores and corresponding gallery labels.
+    Also returns the gallery labels and the query labels.
+    """
+    if metric not in _METRICS:
+        raise ValueError(f'Unknown metric "{metric}"')
+
     if device is None:
         device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    if score_device is None:
+        score_device = device
+    device = _resolve_device(device)
+    score_device = _resolve_device(score_device)
+    if specialize and score_device != device:
+        raise ValueError('specialize requires score_device to be the same '
+                         'as device')
     assert not model.training
     model = model.to(device)
 
-    gal_embs = []
-    gal_labels = []
-    for imgs, labels in tqdm(dl_gal, leave=False):
-        _compute_and_append_embeddings(model, imgs, labels, device,
-                                       gal_embs, gal_labels,
-                                       get_embeddings_fn)
-    gal_embs = torch.cat(gal_embs)
-    gal_labels = torch.cat(gal_labels)
+    _check_pin_memory(dl_gal, 'dl_gal', device)
+    _check_pin_memory(dl_quer, 'dl_quer', device)
+
+    if get_embeddings_fn is None:
+        embeddings_fn = model
+    else:
+        embeddings_fn = partial(get_embeddings_fn, model)
+
+    compiled_embeddings_fn = embeddings_fn
+    if use_compile:
+        compiled_embeddings_fn = torch.compile(embeddings_fn, dynamic=False)
+
+    gal_embs, gal_labels = _embed_gallery(compiled_embeddings_fn, dl_gal,
+                                          device, agg_gal_fn, score_dtype)
+    gal_embs = gal_embs.to(score_device)
+    gal_labels = gal_labels.to(score_device)
+
+    metric_fn = _metric_fn(gal_embs, metric)
+    if k is not None:
+        metric_fn = _top_k_fn(metric_fn, gal_labels, k)
+
+    num_quer = _num_samples(dl_quer)
+
+    if specialize:
+        step_fn = torch.compile(
+            partial(_fused_step, embeddings_fn, metric_fn, score_dtype),
+            mode='reduce-overhead',
+            dynamic=False,
+        )
+        scores, quer_labels = _score_specialized(step_fn, dl_quer, device,
+                                                 num_quer)
+    else:
+        # Only the full score matrix is worth writing in place. A compiled
+        # metric function returns its own output instead.
+        num_cols = len(gal_embs) if k is None else None
+        if use_compile:
+            metric_fn = torch.compile(metric_fn, dynamic=False)
+            num_cols = None
+
+        scorer = _QueryScorer(metric_fn, device, score_device, num_quer,
+                              num_cols)
+        scores, quer_labels = _score_chunked(compiled_embeddings_fn, scorer,
+                                             dl_quer, device, num_quer,
+                                             score_dtype)
+
+    return scores, gal_labels, quer_labels.to(score_device)
+
+
+def _embed_gallery(embeddings_fn, dl_gal, device, agg_gal_fn, score_dtype):
+    """Returns the (aggregated) gallery embeddings and labels."""
+    num_gal = _num_samples(dl_gal)
+    gal_embs = _RowBuffer(num_gal)
+    gal_labels = _RowBuffer(num_gal)
+    for imgs, labels in tqdm(_Prefetcher(dl_gal, device), leave=False):
+        _compute_and_append_embeddings(embeddings_fn, imgs, labels,
+                                       gal_embs, gal_labels)
+    gal_embs = gal_embs.tensor()
+    gal_labels = gal_labels.tensor()
 
     if agg_gal_fn is not None:
         gal_embs, gal_labels = agg_gal_fn(gal_embs, gal_labels)
 
-    scores = []
-    quer_labels = []
-    for imgs, labels in tqdm(dl_quer, leave=False):
-        q_embs = []
-        _compute_and_append_embeddings(model, imgs, labels, device,
-                                       q_embs, quer_labels,
-                                       get_embeddings_fn)
-        q_embs = q_embs[0]
-
-        if metric == 'inner':
-            q_scores = _inner(q_embs, gal_embs)
-        elif metric == 'cosine':
-            q_scores = _cosine(q_embs, gal_embs)
-        elif metric == 'sq_euclid':
-            q_scores = - _sq_euclid(q_embs, gal_embs)
-        elif metric == 'euclid':
-            q_scores = - _euclid(q_embs, gal_embs)
+    if score_dtype is not None:
+        gal_embs = gal_embs.to(score_dtype)
+
+    return gal_embs, gal_labels
+
+
+class _Prefetcher:
+    """Iterates over a data loader and prefetches the batches to a device.
+
+    On CUDA, the host-to-device copy of the next batch is issued in a separate
+    stream, so that it overlaps with the computations on the current batch.
+    For this copy to be truly asynchronous, the data loader should be created
+    with ``pin_memory=True``. On other devices, the batches are simply moved
+    to the device one by one.
+    """
+    def __init__(self, dl, device):
+        self.dl = dl
+        self.device = torch.device(device)
+        self.stream = (torch.cuda.Stream(self.device)
+                       if self.device.type == 'cuda' else None)
+        self.loader_iter = iter(dl)
+        self.preload()
+
+    def __len__(self):
+        return len(self.dl)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.next_imgs is None:
+            raise StopIteration
+
+        if self.stream is not None:
+            current_stream = torch.cuda.current_stream(self.device)
+            current_stream.wait_stream(self.stream)
+            self.next_imgs.record_stream(current_stream)
+            self.next_labels.record_stream(current_stream)
+
+        imgs, labels = self.next_imgs, self.next_labels
+        self.preload()
+
+        return imgs, labels
+
+    def preload(self):
+        try:
+            imgs, labels = next(self.loader_iter)
+        except StopIteration:
+            self.next_imgs, self.next_labels = None, None
+            return
+
+        if self.stream is None:
+            self.next_imgs = imgs.to(self.device, non_blocking=True)
+            self.next_labels = labels.to(self.device, non_blocking=True)
         else:
-            raise ValueError(f'Unknown metric "{metric}"')
+            with torch.cuda.stream(self.stream):
+                self.next_imgs = imgs.to(self.device, non_blocking=True)
+                self.next_labels = labels.to(self.device, non_blocking=True)
 
-        scores.append(q_scores)
 
-    scores = torch.cat(scores)
-    quer_labels = torch.cat(quer_labels)
+def _num_samples(dl):
+    """Returns the number of samples yielded by ``dl``, if known upfront."""
+    if not isinstance(dl, DataLoader) or dl.batch_size is None:
+        return None
 
-    return scores, gal_labels, quer_labels
+    try:
+        num_samples = len(dl.sampler)
+    except TypeError:
+        return None
 
+    if dl.drop_last:
+        num_samples -= num_samples % dl.batch_size
 
-def _inner(t1, t2):
-    return torch.matmul(t1, t2.T)
+    return num_samples
+
+
+class _RowBuffer:
+    """Collects batches of rows into a single tensor.
+
+    When the total number of rows is known upfront, the output tensor is
+    allocated as soon as the first batch arrives and each batch is copied into
+    its own slice. This avoids keeping all batches around and concatenating
+    them afterwards. Otherwise, we fall back to concatenation.
+    """
+    def __init__(self, num_rows=None):
+        self.num_rows = num_rows
+        self.batches = []
+        self.data = None
+        self.cursor = 0
 
+    def append(self, batch):
+        if self.num_rows is None:
+            self.batches.append(batch)
+            return
 
-def _cosine(t1, t2):
-    t1 = t1 / t1.norm(dim=1)
-    t2 = t2 / t2.norm(dim=1)
-    return _inner(t1, t2)
+        rows = self.reserve(len(batch), batch.shape[1:], batch.dtype,
+                            batch.device)
+        rows.copy_(batch)
 
+    def reserve(self, num, row_shape, dtype, device):
+        """Returns the next ``num`` rows of the output, to be written to."""
+        if self.data is None:
+            self.data = torch.empty((self.num_rows, *row_shape), dtype=dtype,
+                                    device=device)
 
-def _sq_euclid(t1, t2):
-    return (t1[:, None, :] - t2[None, ...]).pow(2).sum(dim=-1)
+        rows = self.data[self.cursor:self.cursor + num]
+        self.cursor += num
+        return rows
+
+    def tensor(self):
+        if self.num_rows is None:
+            return torch.cat(self.batches)
+
+        return self.data[:self.cursor]
+
+
+def _resolve_device(device):
+    """Normalizes the device index, so that devices compare.
+
+    All CPU devices are the same device, whatever their index. An unindexed
+    CUDA device is the current CUDA device.
+    """
+    device = torch.device(device)
+    if device.type == 'cpu':
+        device = torch.device('cpu')
+    elif device.type == 'cuda' and device.index is None:
+        device = torch.device('cuda', torch.cuda.current_device())
+    return device
+
+
+def _check_pin_memory(dl, name, device):
+    if (
+        torch.device(device).type == 'cuda'
+        and isinstance(dl, DataLoader)
+        and not dl.pin_memory
+    ):
+        warnings.warn(
+            f'{name} was created without pin_memory=True. Host-to-device '
+            'copies will go through pageable memory and cannot overlap with '
+            'the embedding computations.'
+        )
+
+
+def _normalize(t):
+    return t / t.norm(dim=1, keepdim=True)
+
+
+_METRICS = ('inner', 'cosine', 'sq_euclid', 'euclid')
+
+
+def _metric_fn(gal_embs, metric):
+    """Returns a function that scores a batch of queries against the gallery.
+
+    Preparing the gallery (normalizing, computing its squared norms and laying
+    out its transpose contiguously for the matrix product) happens here, once,
+    instead of for every batch of queries. All metrics are computed with a
+    matrix product, so no intermediate results larger than the scores
+    themselves are needed. The scores can be written into an existing tensor
+    by passing it as ``out``.
+    """
+    if metric == 'inner':
+        gal_embs_t = gal_embs.T.contiguous()
+        return lambda q_embs, out=None: torch.mm(q_embs, gal_embs_t, out=out)
+    elif metric == 'cosine':
+        gal_embs_t = _normalize(gal_embs).T.contiguous()
+        return lambda q_embs, out=None: torch.mm(_normalize(q_embs),
+                                                 gal_embs_t, out=out)
+    elif metric == 'sq_euclid':
+        return partial(_neg_sq_euclid, gal_embs.T.contiguous(),
+                       gal_embs.pow(2).sum(dim=1))
+    elif metric == 'euclid':
+        return partial(_neg_euclid, gal_embs.T.contiguous(),
+                       gal_embs.pow(2).sum(dim=1))
+    else:
+        raise ValueError(f'Unknown metric "{metric}"')
 
 
-def _euclid(t1, t2):
-    return _sq_euclid(t1, t2).sqrt()
+def _sq_euclid(gal_embs_t, gal_sq_norms, q_embs, out=None):
+    # ||q - g||^2 = ||g||^2 - 2 q.g + ||q||^2, clamped to avoid negative
+    # values due to rounding errors
+    sq_dists = torch.addmm(gal_sq_norms, q_embs, gal_embs_t, alpha=-2,
+                           out=out)
+    sq_dists.add_(q_embs.pow(2).sum(dim=1, keepdim=True))
+    return sq_dists.clamp_(min=0)
+
+
+def _neg_sq_euclid(gal_embs_t, gal_sq_norms, q_embs, out=None):
+    return _sq_euclid(gal_embs_t, gal_sq_norms, q_embs, out).neg_()
+
+
+def _neg_euclid(gal_embs_t, gal_sq_norms, q_embs, out=None):
+    return _sq_euclid(gal_embs_t, gal_sq_norms, q_embs, out).sqrt_().neg_()
+
+
+def _top_k_fn(metric_fn, gal_labels, k):
+    """Returns a function that keeps the top k scores of ``metric_fn``."""
+    k = min(k, len(gal_labels))
+
+    def top_k_fn(q_embs):
+        top_k_scores, top_k_idxs = torch.topk(metric_fn(q_embs), k, dim=1)
+        return top_k_scores, gal_labels[top_k_idxs]
+
+    return top_k_fn
+
+
+# The number of query embeddings to collect before scoring them with a single
+# call of a metric function. This keeps the matrix products large, while
+# bounding the memory needed for the pending query embeddings.
+_SCORE_CHUNK_SIZE = 8192
+
+
+class _QueryScorer:
+    """Scores the query embeddings in chunks, as they come in.
+
+    As soon as enough query embeddings are available, they are scored against
+    the gallery with ``metric_fn``, which returns a tensor or a tuple of
+    tensors with a row for each query. The remaining queries are scored when
+    calling :meth:`tensors`.
+
+    When scoring on the device that computes the embeddings, the pending
+    embeddings are concatenated into a chunk. On CUDA, this chunk is scored in
+    a separate stream, so that the scoring of one chunk overlaps with the
+    embedding extraction of the next query batches.
+
+    When scoring on another device, the embeddings are copied into a single
+    buffer on that device, which is reused for every chunk. If the embeddings
+    are computed on CUDA and scored on CPU, this buffer is pinned.
+
+    If ``num_cols`` and ``num_rows`` are given, ``metric_fn`` should return a
+    single tensor with ``num_cols`` columns and accept an ``out`` argument.
+    The output is then allocated once and each chunk is scored straight into
+    its own rows, instead of into a temporary tensor that is copied.
+    """
+    def __init__(self, metric_fn, device, score_device, num_rows=None,
+                 num_cols=None):
+        self.metric_fn = metric_fn
+        self.device = _resolve_device(device)
+        self.score_device = _resolve_device(score_device)
+        self.stream = (torch.cuda.Stream(self.device)
+                       if self.device.type == 'cuda'
+                       and self.device == self.score_device else None)
+        self.pending = []
+        self.num_pending = 0
+        self.staging = None
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.results = None
+
+    def append(self, q_embs):
+        if self.device == self.score_device:
+            self.pending.append(q_embs)
+        else:
+            if self.num_pending + len(q_embs) > _SCORE_CHUNK_SIZE:
+                self.score_pending()
+            self.stage(q_embs)
+
+        self.num_pending += len(q_embs)
+
+        if self.num_pending >= _SCORE_CHUNK_SIZE:
+            self.score_pending()
+
+    def stage(self, q_embs):
+        if self.staging is None or len(self.staging) < len(q_embs):
+            self.staging = torch.empty(
+                (max(_SCORE_CHUNK_SIZE, len(q_embs)), *q_embs.shape[1:]),
+                dtype=q_embs.dtype,
+                device=self.score_device,
+                pin_memory=(self.device.type == 'cuda'
+                            and self.score_device.type == 'cpu'),
+            )
+
+        end = self.num_pending + len(q_embs)
+        self.staging[self.num_pending:end].copy_(q_embs, non_blocking=True)
+
+    def score_pending(self):
+        if self.num_pending == 0:
+            return
+
+        if self.device == self.score_device:
+            chunk = torch.cat(self.pending)
+            self.pending = []
+        else:
+            if self.device.type == 'cuda':
+                torch.cuda.current_stream(self.device).synchronize()
+            chunk = self.staging[:self.num_pending]
+        self.num_pending = 0
+
+        if self.stream is None:
+            self.score(chunk)
+            return
+
+        self.stream.wait_stream(torch.cuda.current_stream(self.device))
+        with torch.cuda.stream(self.stream):
+            self.score(chunk)
+        chunk.record_stream(self.stream)
+
+    def score(self, chunk):
+        if self.num_rows is None or self.num_cols is None:
+            self.append_results(self.metric_fn(chunk))
+            return
+
+        if self.results is None:
+            self.results = [_RowBuffer(self.num_rows)]
+
+        out = self.results[0].reserve(len(chunk), (self.num_cols,),
+                                      chunk.dtype, chunk.device)
+        self.metric_fn(chunk, out=out)
+
+    def append_results(self, results):
+        if isinstance(results, torch.Tensor):
+            results = (results,)
+
+        if self.results is None:
+            self.results = [_RowBuffer(self.num_rows) for _ in results]
+
+        for buffer, result in zip(self.results, results):
+            buffer.append(result)
+
+    def tensors(self):
+        self.score_pending()
+
+        if self.results is None:
+            raise ValueError('dl_quer did not yield any queries')
+
+        if self.stream is None:
+            return tuple(buffer.tensor() for buffer in self.results)
+
+        # The results were written in the side stream, so they should be
+        # gathered there as well, before handing them to the current stream.
+        with torch.cuda.stream(self.stream):
+            results = tuple(buffer.tensor() for buffer in self.results)
+
+        current_stream = torch.cuda.current_stream(self.device)
+        current_stream.wait_stream(self.stream)
+        for result in results:
+            result.record_stream(current_stream)
+
+        return results
+
+
+def _score_chunked(embeddings_fn, scorer, dl_quer, device, num_quer,
+                   score_dtype):
+    """Embeds the queries and scores them in chunks with a ``_QueryScorer``.
+
+    Returns a tuple with the results of the scorer and the query labels.
+    """
+    quer_labels = _RowBuffer(num_quer)
+    for imgs, labels in tqdm(_Prefetcher(dl_quer, device), leave=False):
+        _compute_and_append_embeddings(embeddings_fn, imgs, labels,
+                                       scorer, quer_labels, score_dtype)
+    return scorer.tensors(), quer_labels.tensor()
+
+
+def _score_specialized(step_fn, dl_quer, device, num_quer):
+    """Embeds and scores the queries batch by batch with a compiled step.
+
+    Batches smaller than the first one are padded to its size, so that
+    ``step_fn`` is always called with the same shapes. Returns a tuple with
+    the results of ``step_fn`` for all queries and the query labels.
+    """
+    scores = None
+    quer_labels = _RowBuffer(num_quer)
+    batch_size = None
+    for imgs, labels in tqdm(_Prefetcher(dl_quer, device), leave=False):
+        if batch_size is None:
+            batch_size = len(imgs)
+        results = step_fn(_pad_batch(imgs, batch_size))
+        if scores is None:
+            scores = [_RowBuffer(num_quer) for _ in results]
+        for buffer, result in zip(scores, results):
+            result = result[:len(imgs)]
+            if num_quer is None:
+                # The outputs of a CUDA graph are overwritten by the next
+                # call, so they cannot be kept around for concatenation
+                result = result.clone()
+            buffer.append(result)
+        quer_labels.append(labels)
+
+    if scores is None:
+        raise ValueError('dl_quer did not yield any queries')
+
+    return tuple(buffer.tensor() for buffer in scores), quer_labels.tensor()
+
+
+def _fused_step(embeddings_fn, metric_fn, dtype, imgs):
+    q_embs = embeddings_fn(imgs)
+    if dtype is not None:
+        q_embs = q_embs.to(dtype)
+    return metric_fn(q_embs)
+
+
+def _pad_batch(imgs, batch_size):
+    if len(imgs) >= batch_size:
+        return imgs
+
+    padding = imgs.new_zeros((batch_size - len(imgs), *imgs.shape[1:]))
+    return torch.cat([imgs, padding])
 
 
 def _compute_and_append_embeddings(
-    model,
+    embeddings_fn,
     imgs,
     labels,
-    device,
     embedding_list,
     label_list,
-    get_embeddings_fn,
+    dtype=None,
 ):
-    imgs = imgs.to(device)
-    labels = labels.to(device)
+    out = embeddings_fn(imgs)
+    assert len(labels) == len(out)
 
-    if get_embeddings_fn is None:
-        out = model(imgs)
-    else:
-        out = get_embeddings_fn(model, imgs)
-        assert len(labels) == len(out)
+    if dtype is not None:
+        out = out.to(dtype)
 
     embedding_list.append(out)
     label_list.append(labels)
@@ -161,13 +696,17 @@ def sort_scores(
     Returns:
         A tuple with the sorted scores and labels.
     """
-    if scores.shape[1] != gallery_labels.shape[0]:
-        raise ValueError(
-            f"Inconsistent shape for score matrix ({scores.shape}) "
-            f"and gallery labels ({gallery_labels.shape})."
-        )
+    _check_score_shapes(scores, gallery_labels)
     sorted_idxs = torch.argsort(scores, dim=1, descending=True)
     sorted_scores = torch.gather(scores, dim=1, index=sorted_idxs)
     sorted_labels = torch.gather(gallery_labels.expand_as(sorted_idxs),
                                  dim=1, index=sorted_idxs)
     return sorted_scores, sorted_labels
+
+
+def _check_score_shapes(scores, gallery_labels):
+    if scores.shape[1] != gallery_labels.shape[0]:
+        raise ValueError(
+            f"Inconsistent shape for score matrix ({scores.shape}) "
+            f"and gallery labels ({gallery_labels.shape})."
+        )
@@ -1,4 +1,5 @@
 import pandas as pd
+import pytest
 from PIL import Image
 from torchvision.transforms.functional import to_tensor
 
@@ -37,3 +38,53 @@ def test_data_frame_dataset(tmp_path):
 
         assert (to_tensor(ret_im) == to_tensor(exp_im)).all()
         assert ret_label == exp_label
+
+
+def test_missing_label_to_int():
+    df = pd.DataFrame([
+        {'image': 'A_0000.jpg', 'label': 'A'},
+        {'image': 'B_0000.jpg', 'label': 'B'},
+    ])
+
+    with pytest.raises(KeyError, match='Labels missing from label_to_int'):
+        DataFrameDataset(df, label_key='label', image_key='image',
+                         label_to_int={'A': 0})
+
+
+def test_integer_labels_without_label_to_int(tmp_path):
+    df = pd.DataFrame([
+        {'image': str(tmp_path / 'A_0000.jpg'), 'label': 7},
+        {'image': str(tmp_path / 'B_0000.jpg'), 'label': 3},
+    ])
+    for img_path in df['image']:
+        Image.new('RGB', (2, 2)).save(img_path)
+
+    ds = DataFrameDataset(df, label_key='label', image_key='image',
+                          label_to_int=None)
+
+    assert ds.unique_labels == {3, 7}
+    assert [ds[i][1] for i in range(len(ds))] == [7, 3]
+
+
+def test_non_integer_labels_without_label_to_int():
+    df = pd.DataFrame([
+        {'image': 'A_0000.jpg', 'label': 'A'},
+    ])
+
+    with pytest.raises(TypeError, match='label_to_int can only be None'):
+        DataFrameDataset(df, label_key='label', image_key='image',
+                         label_to_int=None)
+
+
+def test_df_read_only():
+    df = pd.DataFrame([
+        {'image': 'A_0000.jpg', 'label': 'A'},
+        {'image': 'B_0000.jpg', 'label': 'B'},
+    ])
+    ds = DataFrameDataset(df, label_key='label', image_key='image',
+                          label_to_int={'A': 0, 'B': 1})
+
+    assert ds.df is df
+    with pytest.raises(AttributeError):
+        ds.df = df.iloc[:1]
+    assert len(ds) == 2
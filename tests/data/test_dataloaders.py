@@ -0,0 +1,47 @@
+import pytest
+import torch
+from torch.utils.data import TensorDataset
+
+from recognite.data import train_val_dataloaders
+
+
+@pytest.fixture
+def datasets():
+    return tuple(
+        TensorDataset(torch.arange(n, dtype=torch.float), torch.arange(n))
+        for n in [6, 2, 4]
+    )
+
+
+def test_train_val_dataloaders(datasets):
+    dls = train_val_dataloaders(*datasets, batch_size=2, num_workers=1)
+
+    for dl, ds in zip(dls, datasets):
+        assert dl.dataset is ds
+        assert dl.batch_size == 2
+        assert dl.num_workers == 1
+        assert dl.persistent_workers
+        assert dl.prefetch_factor == 2
+        assert dl.pin_memory == torch.cuda.is_available()
+
+    dl_train, dl_gal, dl_quer = dls
+    assert isinstance(dl_train.sampler, torch.utils.data.RandomSampler)
+    assert isinstance(dl_gal.sampler, torch.utils.data.SequentialSampler)
+    assert isinstance(dl_quer.sampler, torch.utils.data.SequentialSampler)
+
+
+def test_no_workers(datasets):
+    dls = train_val_dataloaders(*datasets, batch_size=2, num_workers=0,
+                                shuffle_train=False)
+
+    for dl, ds in zip(dls, datasets):
+        assert not dl.persistent_workers
+        assert isinstance(dl.sampler, torch.utils.data.SequentialSampler)
+        assert torch.cat([labels for _, labels in dl]).tolist() \
+            == ds.tensors[1].tolist()
+
+
+@pytest.mark.cuda
+def test_warn_no_workers_cuda(datasets):
+    with pytest.warns(match=r'Using num_workers=0 while CUDA is available'):
+        train_val_dataloaders(*datasets, batch_size=2, num_workers=0)
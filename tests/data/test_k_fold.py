@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 from recognite.data import k_fold_trainval_split
@@ -110,3 +111,17 @@ def test_label_key():
     )
     assert len(df_val['name'].unique()) == 1
     assert len(df_train['name'].unique()) == 2
+
+
+def test_global_random_state_untouched():
+    df = pd.DataFrame([
+        {'label': 'A', 'image': 'A_0001.jpg'},
+        {'label': 'B', 'image': 'B_0001.jpg'},
+        {'label': 'C', 'image': 'C_0001.jpg'},
+    ])
+    np.random.seed(1)
+    exp_state = np.random.get_state()[1].copy()
+
+    k_fold_trainval_split(df, num_folds=3, val_fold=0, seed=0)
+
+    assert (np.random.get_state()[1] == exp_state).all()
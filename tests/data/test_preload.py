@@ -0,0 +1,76 @@
+import pytest
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from recognite.data import preload
+
+
+@pytest.fixture
+def dl():
+    return [
+        (torch.ones(2, 3), torch.tensor([0, 1])),
+        (torch.zeros(2, 3), torch.tensor([2, 3])),
+    ]
+
+
+def test_preload(dl):
+    ret_batches = preload(dl, 'cpu')
+
+    assert isinstance(ret_batches, list)
+    assert len(ret_batches) == len(dl)
+    for (ret_imgs, ret_labels), (exp_imgs, exp_labels) in zip(ret_batches,
+                                                              dl):
+        assert (ret_imgs == exp_imgs).all()
+        assert (ret_labels == exp_labels).all()
+
+
+def test_preload_max_bytes(dl):
+    num_bytes = 12 * torch.ones(1).element_size()
+
+    assert isinstance(preload(dl, 'cpu', max_bytes=num_bytes), list)
+
+    with pytest.warns(match=r'The images do not fit in 8 bytes\.'):
+        ret = preload(dl, 'cpu', max_bytes=8)
+    assert ret is dl
+
+
+def test_preload_max_bytes_data_loader():
+    class CountingDataset(Dataset):
+        def __init__(self):
+            self.num_loaded = 0
+
+        def __len__(self):
+            return 10
+
+        def __getitem__(self, idx):
+            self.num_loaded += 1
+            return torch.ones(3), idx
+
+    ds = CountingDataset()
+    dl = DataLoader(ds, batch_size=2)
+
+    with pytest.warns(match=r'The images do not fit in 96 bytes\.'):
+        ret = preload(dl, 'cpu', max_bytes=96)
+
+    assert ret is dl
+    assert ds.num_loaded == 2
+
+
+@pytest.mark.cuda
+def test_preload_cuda(dl):
+    ret_batches = preload(dl, 'cuda')
+
+    for imgs, labels in ret_batches:
+        assert imgs.is_cuda and labels.is_cuda
+
+
+def test_preload_max_bytes_generator(dl):
+    with pytest.warns(match=r'The images do not fit in 8 bytes\.'):
+        ret = preload((batch for batch in dl), 'cpu', max_bytes=8)
+
+    ret_batches = list(ret)
+    assert len(ret_batches) == len(dl)
+    for (ret_imgs, ret_labels), (exp_imgs, exp_labels) in zip(ret_batches,
+                                                              dl):
+        assert (ret_imgs == exp_imgs).all()
+        assert (ret_labels == exp_labels).all()
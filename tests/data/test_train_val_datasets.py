@@ -2,7 +2,7 @@ import pandas as pd
 from PIL import Image
 import pytest
 
-from recognite.data import train_val_datasets
+from recognite.data import train_val_datasets, train_val_datasets_from_df
 
 
 def test_no_overlaps(dummy_dataset):
@@ -90,6 +90,7 @@ def test_default_args(dummy_dataset_default):
         ref_seed=0,
         tfm_train=None,
         tfm_val=None,
+        cache_parquet=False,
     )
 
     datasets_0 = train_val_datasets(ds_kwargs['data_csv_file'])
@@ -99,6 +100,55 @@ def test_default_args(dummy_dataset_default):
         assert (ds_0.df == ds_1.df).all().all()
 
 
+def test_from_df(dummy_dataset):
+    df_all, ds_kwargs = dummy_dataset
+    datasets = train_val_datasets(**ds_kwargs)
+
+    data_csv_file = ds_kwargs.pop('data_csv_file')
+    datasets_df = train_val_datasets_from_df(pd.read_csv(data_csv_file),
+                                             **ds_kwargs)
+
+    for ds_0, ds_1 in zip(datasets, datasets_df):
+        assert (ds_0.df == ds_1.df).all().all()
+        assert ds_0.label_to_int == ds_1.label_to_int
+
+
+def test_cache_parquet(dummy_dataset):
+    pytest.importorskip('pyarrow')
+    df_all, ds_kwargs = dummy_dataset
+    data_csv_file = ds_kwargs['data_csv_file']
+    cache_file = data_csv_file.with_name(data_csv_file.name + '.parquet')
+    # A Parquet file with the same stem belongs to the user
+    user_file = data_csv_file.with_suffix('.parquet')
+    user_file.write_bytes(b'user data')
+
+    datasets = train_val_datasets(**ds_kwargs)
+    assert not cache_file.exists()
+
+    datasets_0 = train_val_datasets(**ds_kwargs, cache_parquet=True)
+    assert cache_file.exists()
+    datasets_1 = train_val_datasets(**ds_kwargs, cache_parquet=True)
+    assert user_file.read_bytes() == b'user data'
+
+    for ds, ds_0, ds_1 in zip(datasets, datasets_0, datasets_1):
+        assert (ds.df == ds_0.df).all().all()
+        assert (ds.df == ds_1.df).all().all()
+
+
+def test_integer_labels(dummy_dataset):
+    df_all, ds_kwargs = dummy_dataset
+    df_all['my_label'] = df_all['my_label'].map({'A': 10, 'B': 20, 'C': 30})
+    df_all.to_csv(ds_kwargs['data_csv_file'], index=False)
+
+    ds_train, ds_val_gal, ds_val_quer = train_val_datasets(**ds_kwargs)
+
+    assert sorted(ds_train.label_to_int.values()) == [0, 1]
+    for ds in [ds_val_gal, ds_val_quer]:
+        assert ds.label_to_int is None
+        for i in range(len(ds)):
+            assert ds[i][1] == ds.df['my_label'].iloc[i]
+
+
 @pytest.fixture
 def dummy_dataset(tmp_path):
     return _dummy_dataset(tmp_path, 'my_image', 'my_label')
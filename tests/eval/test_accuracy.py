@@ -1,5 +1,5 @@
 import torch
-from recognite.eval import accuracy, top_k_accuracy
+from recognite.eval import accuracy, top_k_accuracy, top_all_accuracy
 
 
 def test_perfect_accuracy():
@@ -100,3 +100,33 @@ def test_perfect_top_2_accuracy():
     exp_acc = 1.0
     ret_acc = top_k_accuracy(scores, gallery_labels, query_labels, k=2)
     assert exp_acc == ret_acc
+
+
+def test_accuracy_returns_scalar_tensor():
+    scores = torch.tensor([
+        [1, 0],
+        [0, 1],
+        [1, 0],
+    ])
+    query_labels = torch.tensor([0, 0, 0])
+    gallery_labels = torch.tensor([0, 1])
+
+    for k in [1, 2]:
+        ret_acc = top_k_accuracy(scores, gallery_labels, query_labels, k=k)
+        assert ret_acc.dim() == 0
+        assert ret_acc.dtype == torch.float
+
+    assert torch.isclose(accuracy(scores, gallery_labels, query_labels),
+                         torch.tensor(2 / 3))
+
+
+def test_top_all_accuracy():
+    query_labels = torch.tensor([0, 1, 2, 3])
+    top_all_labels = torch.tensor([
+        [1, 0],
+        [1, 2],
+        [0, 1],
+        [0, 1],
+    ])
+    ret_acc = top_all_accuracy(query_labels, top_all_labels)
+    assert ret_acc == 0.5
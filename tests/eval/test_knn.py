@@ -52,3 +52,16 @@ def test_3_nn():
     ret_pred = knn(scores, gal_labels, k=3)
 
     assert (exp_pred == ret_pred).all()
+
+
+def test_top_k_larger_than_gallery():
+    scores = torch.tensor([
+        [0.1, 0.9],
+        [0.8, 0.2],
+    ])
+    gal_labels = torch.tensor([0, 1])
+
+    ret_scores, ret_labels = top_k(scores, gal_labels, k=3)
+
+    assert (ret_scores == torch.tensor([[0.9, 0.1], [0.8, 0.2]])).all()
+    assert (ret_labels == torch.tensor([[1, 0], [0, 1]])).all()
@@ -1,9 +1,11 @@
 import math
+import sys
 
 import pytest
 import torch
 
-from recognite.eval import score_matrix
+from recognite.eval import score_matrix, score_matrix_top_k, top_k
+from recognite.eval.score_matrix import _Prefetcher, _QueryScorer
 
 
 @pytest.fixture()
@@ -177,3 +179,344 @@ def test_device_default_cuda(score_matrix_args):
         == ret_q_labels.device
     )
     assert str(ret_scores.device).startswith('cuda')
+
+
+def test_prefetcher_yields_all_batches(score_matrix_args):
+    dl_gal, dl_quer, model = score_matrix_args
+
+    batches = list(_Prefetcher(dl_quer, 'cpu'))
+
+    assert len(batches) == len(dl_quer)
+    for (ret_imgs, ret_labels), (exp_imgs, exp_labels) in zip(batches,
+                                                              dl_quer):
+        assert (ret_imgs == exp_imgs).all()
+        assert (ret_labels == exp_labels).all()
+
+
+@pytest.mark.cuda
+def test_warn_no_pin_memory():
+    dl = torch.utils.data.DataLoader(
+        torch.utils.data.TensorDataset(torch.ones(4, 2), torch.zeros(4)),
+        batch_size=2, pin_memory=False
+    )
+    model = torch.nn.Identity()
+    model.eval()
+
+    with pytest.warns(match=r'dl_gal was created without pin_memory=True'):
+        score_matrix(model, dl_gal=dl, dl_quer=dl, device='cuda')
+
+
+@pytest.mark.parametrize('drop_last', [False, True])
+def test_score_matrix_data_loader(drop_last):
+    ds = torch.utils.data.TensorDataset(
+        torch.arange(10, dtype=torch.float).reshape(5, 2),
+        torch.arange(5),
+    )
+    dl = torch.utils.data.DataLoader(ds, batch_size=2, drop_last=drop_last)
+    model = torch.nn.Identity()
+    model.eval()
+
+    ret_scores, ret_g_labels, ret_q_labels = score_matrix(
+        model, dl_gal=dl, dl_quer=dl, device='cpu'
+    )
+
+    num_samples = 4 if drop_last else 5
+    embs = ds.tensors[0][:num_samples]
+    assert torch.isclose(ret_scores, embs @ embs.T).all()
+    assert (ret_g_labels == ds.tensors[1][:num_samples]).all()
+    assert (ret_q_labels == ds.tensors[1][:num_samples]).all()
+
+
+def test_get_score_matrix_cosine_batched():
+    embs = torch.tensor([
+        [3.0, 4.0],
+        [0.0, 2.0],
+        [-1.0, 0.0],
+    ])
+    dl = [(embs, torch.arange(3))]
+    model = torch.nn.Identity()
+    model.eval()
+
+    ret_scores, _, _ = score_matrix(
+        model, metric='cosine', device='cpu', dl_gal=dl, dl_quer=dl,
+    )
+
+    norm_embs = embs / embs.norm(dim=1, keepdim=True)
+    assert torch.isclose(ret_scores, norm_embs @ norm_embs.T).all()
+
+
+def test_score_chunks(score_matrix_args, monkeypatch):
+    dl_gal, dl_quer, model = score_matrix_args
+
+    exp_scores, _, _ = score_matrix(model, dl_gal, dl_quer, device='cpu')
+
+    monkeypatch.setattr(sys.modules['recognite.eval.score_matrix'],
+                        '_SCORE_CHUNK_SIZE', 3)
+    ret_scores, _, _ = score_matrix(model, dl_gal, dl_quer, device='cpu')
+
+    assert torch.isclose(exp_scores, ret_scores).all()
+
+
+def test_unknown_metric(score_matrix_args):
+    dl_gal, dl_quer, model = score_matrix_args
+
+    with pytest.raises(ValueError, match='Unknown metric "foo"'):
+        score_matrix(model, dl_gal, dl_quer, metric='foo', device='cpu')
+
+
+@pytest.mark.parametrize('score_dtype', [torch.float16, torch.bfloat16])
+def test_score_dtype(score_matrix_args, score_dtype):
+    dl_gal, dl_quer, model = score_matrix_args
+
+    exp_scores = torch.tensor([
+        [4.0, -4.0],
+        [0.0,  0.0],
+        [-4.0, 4.0],
+        [0.0,  0.0],
+    ])
+
+    ret_scores, _, _ = score_matrix(
+        model,
+        device='cpu',
+        dl_gal=dl_gal,
+        dl_quer=dl_quer,
+        score_dtype=score_dtype,
+    )
+
+    assert ret_scores.dtype == score_dtype
+    assert torch.isclose(exp_scores, ret_scores.float()).all()
+
+
+def test_inference_tensors(score_matrix_args):
+    dl_gal, dl_quer, model = score_matrix_args
+
+    ret_scores, ret_g_labels, ret_q_labels = score_matrix(
+        model, dl_gal, dl_quer, device='cpu'
+    )
+
+    assert ret_scores.is_inference()
+    assert ret_g_labels.is_inference()
+    assert ret_q_labels.is_inference()
+
+
+@pytest.mark.slow
+def test_use_compile(score_matrix_args):
+    dl_gal, dl_quer, _ = score_matrix_args
+    model = torch.nn.Linear(2, 3)
+    model.eval()
+
+    exp_scores, _, _ = score_matrix(model, dl_gal, dl_quer, device='cpu')
+    ret_scores, _, _ = score_matrix(model, dl_gal, dl_quer, device='cpu',
+                                    use_compile=True)
+
+    assert torch.isclose(exp_scores, ret_scores).all()
+
+
+@pytest.mark.cuda
+def test_score_device_cpu(score_matrix_args, monkeypatch):
+    dl_gal, dl_quer, model = score_matrix_args
+    monkeypatch.setattr(sys.modules['recognite.eval.score_matrix'],
+                        '_SCORE_CHUNK_SIZE', 3)
+
+    exp_scores, exp_g_labels, exp_q_labels = score_matrix(
+        model, dl_gal, dl_quer, device='cpu'
+    )
+    ret_scores, ret_g_labels, ret_q_labels = score_matrix(
+        model, dl_gal, dl_quer, device='cuda', score_device='cpu'
+    )
+
+    assert (
+        ret_scores.device
+        == ret_g_labels.device
+        == ret_q_labels.device
+        == torch.device('cpu')
+    )
+    assert torch.isclose(exp_scores, ret_scores).all()
+    assert (exp_g_labels == ret_g_labels).all()
+    assert (exp_q_labels == ret_q_labels).all()
+
+
+@pytest.mark.parametrize('metric', ['inner', 'cosine', 'sq_euclid', 'euclid'])
+@pytest.mark.parametrize('k', [1, 2, 3])
+def test_score_matrix_top_k(score_matrix_args, monkeypatch, metric, k):
+    dl_gal, dl_quer, model = score_matrix_args
+    monkeypatch.setattr(sys.modules['recognite.eval.score_matrix'],
+                        '_SCORE_CHUNK_SIZE', 3)
+
+    scores, gal_labels, exp_q_labels = score_matrix(
+        model, dl_gal, dl_quer, metric=metric, device='cpu'
+    )
+    exp_scores, _ = top_k(scores, gal_labels, k)
+
+    ret_scores, ret_labels, ret_q_labels = score_matrix_top_k(
+        model, dl_gal, dl_quer, k=k, metric=metric, device='cpu'
+    )
+
+    assert torch.isclose(exp_scores, ret_scores).all()
+    assert (ret_labels == gal_labels[
+        torch.topk(scores, min(k, len(gal_labels)), dim=1).indices
+    ]).all()
+    assert (exp_q_labels == ret_q_labels).all()
+
+
+@pytest.mark.slow
+def test_score_matrix_top_k_specialize():
+    embs = torch.randn(10, 4, generator=torch.Generator().manual_seed(0))
+    dl_gal = [(embs[:5], torch.arange(5))]
+    dl_quer = [(embs[5:7], torch.arange(2)), (embs[7:9], torch.arange(2, 4)),
+               (embs[9:], torch.arange(4, 5))]
+    model = torch.nn.Identity()
+    model.eval()
+
+    exp_scores, exp_labels, exp_q_labels = score_matrix_top_k(
+        model, dl_gal, dl_quer, k=2, device='cpu'
+    )
+    ret_scores, ret_labels, ret_q_labels = score_matrix_top_k(
+        model, dl_gal, dl_quer, k=2, device='cpu', specialize=True
+    )
+
+    assert torch.isclose(exp_scores, ret_scores).all()
+    assert (exp_labels == ret_labels).all()
+    assert (exp_q_labels == ret_q_labels).all()
+
+
+def test_specialize_score_device(score_matrix_args):
+    dl_gal, dl_quer, model = score_matrix_args
+
+    with pytest.raises(ValueError, match='specialize requires score_device'):
+        score_matrix_top_k(model, dl_gal, dl_quer, k=1, device='cpu',
+                           score_device='meta', specialize=True)
+
+
+@pytest.mark.cuda
+def test_score_matrix_cuda_batch_list(monkeypatch):
+    monkeypatch.setattr(sys.modules['recognite.eval.score_matrix'],
+                        '_SCORE_CHUNK_SIZE', 3)
+    embs = torch.randn(10, 4, generator=torch.Generator().manual_seed(0))
+    dl_gal = [(embs[:4], torch.arange(4))]
+    dl_quer = [(embs[i:i + 2], torch.arange(i, i + 2))
+               for i in range(0, 10, 2)]
+    model = torch.nn.Identity()
+    model.eval()
+
+    exp_scores, _, exp_q_labels = score_matrix(model, dl_gal, dl_quer,
+                                               device='cpu')
+    ret_scores, _, ret_q_labels = score_matrix(model, dl_gal, dl_quer,
+                                               device='cuda')
+
+    assert torch.isclose(exp_scores, ret_scores.cpu(), atol=1e-5).all()
+    assert (exp_q_labels == ret_q_labels.cpu()).all()
+
+
+def test_score_device_staging(monkeypatch):
+    # Without normalizing the device index, 'cpu' and 'cpu:0' compare unequal,
+    # which forces the staging path
+    monkeypatch.setattr(sys.modules['recognite.eval.score_matrix'],
+                        '_SCORE_CHUNK_SIZE', 3)
+    monkeypatch.setattr(sys.modules['recognite.eval.score_matrix'],
+                        '_resolve_device', torch.device)
+    embs = torch.randn(10, 4, generator=torch.Generator().manual_seed(0))
+    dl_gal = [(embs[:4], torch.arange(4))]
+    dl_quer = [(embs[i:i + 2], torch.arange(i, i + 2))
+               for i in range(0, 10, 2)]
+    model = torch.nn.Identity()
+    model.eval()
+
+    exp_scores, exp_g_labels, exp_q_labels = score_matrix(
+        model, dl_gal, dl_quer, device='cpu'
+    )
+    ret_scores, ret_g_labels, ret_q_labels = score_matrix(
+        model, dl_gal, dl_quer, device='cpu', score_device='cpu:0'
+    )
+
+    assert torch.isclose(exp_scores, ret_scores).all()
+    assert (exp_g_labels == ret_g_labels).all()
+    assert (exp_q_labels == ret_q_labels).all()
+
+
+def test_indexed_cpu_device_is_same_device():
+    scorer = _QueryScorer(lambda q: q, 'cpu', 'cpu:0')
+
+    assert scorer.device == scorer.score_device
+
+
+@pytest.mark.cuda
+def test_unindexed_cuda_device_is_same_device():
+    scorer = _QueryScorer(lambda q: q, 'cuda', 'cuda:0')
+
+    assert scorer.device == scorer.score_device
+    assert scorer.stream is not None
+
+
+@pytest.mark.parametrize('metric', ['sq_euclid', 'euclid'])
+def test_euclid_chunks(monkeypatch, metric):
+    monkeypatch.setattr(sys.modules['recognite.eval.score_matrix'],
+                        '_SCORE_CHUNK_SIZE', 3)
+    embs = torch.randn(16, 4, generator=torch.Generator().manual_seed(0))
+    dl_gal = [(embs[:6], torch.arange(6))]
+    dl_quer = [(embs[i:i + 2], torch.arange(i, i + 2))
+               for i in range(6, 16, 2)]
+    model = torch.nn.Identity()
+    model.eval()
+
+    ret_scores, _, _ = score_matrix(model, dl_gal, dl_quer, metric=metric,
+                                    device='cpu')
+
+    exp_scores = - torch.cdist(embs[6:], embs[:6])
+    if metric == 'sq_euclid':
+        exp_scores = - exp_scores.pow(2)
+    assert torch.isclose(exp_scores, ret_scores, atol=1e-5).all()
+
+
+@pytest.mark.parametrize('metric', ['inner', 'cosine', 'sq_euclid', 'euclid'])
+def test_score_in_place_chunks(monkeypatch, metric):
+    monkeypatch.setattr(sys.modules['recognite.eval.score_matrix'],
+                        '_SCORE_CHUNK_SIZE', 3)
+    ds = torch.utils.data.TensorDataset(
+        torch.randn(10, 4, generator=torch.Generator().manual_seed(0)),
+        torch.arange(10),
+    )
+    dl = torch.utils.data.DataLoader(ds, batch_size=2)
+    model = torch.nn.Identity()
+    model.eval()
+
+    # The data loader's length is known, so the chunks are scored straight
+    # into the output. A list of batches is scored chunk by chunk and
+    # concatenated instead.
+    ret_scores, _, _ = score_matrix(model, dl, dl, metric=metric,
+                                    device='cpu')
+    exp_scores, _, _ = score_matrix(model, list(dl), list(dl), metric=metric,
+                                    device='cpu')
+
+    assert torch.isclose(exp_scores, ret_scores, atol=1e-5).all()
+
+
+@pytest.mark.slow
+def test_score_matrix_top_k_specialize_data_loader():
+    ds = torch.utils.data.TensorDataset(
+        torch.randn(5, 4, generator=torch.Generator().manual_seed(0)),
+        torch.arange(5),
+    )
+    dl = torch.utils.data.DataLoader(ds, batch_size=2)
+    model = torch.nn.Identity()
+    model.eval()
+
+    exp_scores, exp_labels, exp_q_labels = score_matrix_top_k(
+        model, dl, dl, k=2, device='cpu'
+    )
+    ret_scores, ret_labels, ret_q_labels = score_matrix_top_k(
+        model, dl, dl, k=2, device='cpu', specialize=True
+    )
+
+    assert torch.isclose(exp_scores, ret_scores).all()
+    assert (exp_labels == ret_labels).all()
+    assert (exp_q_labels == ret_q_labels).all()
+
+
+@pytest.mark.parametrize('specialize', [False, True])
+def test_score_matrix_top_k_no_queries(score_matrix_args, specialize):
+    dl_gal, _, model = score_matrix_args
+
+    with pytest.raises(ValueError, match='dl_quer did not yield any queries'):
+        score_matrix_top_k(model, dl_gal, [], k=1, device='cpu',
+                           specialize=specialize)